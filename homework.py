@@ -1,33 +1,126 @@
+import json
 import os
+import random
+import select
+import signal
+import socket
 import sys
+import tempfile
 import time
 import requests
 import telegram
+from requests.adapters import HTTPAdapter
 from telegram import TelegramError
+from telegram.error import RetryAfter
 import logging
+from collections import OrderedDict
+from contextlib import suppress
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from typing import Optional
 from dotenv import load_dotenv
 from exceptions import ApiErrorException
 from http import HTTPStatus
+from urllib3.util.retry import Retry
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-handler = logging.StreamHandler(sys.stdout)
-logger.addHandler(handler)
-
-formatter = logging.Formatter('%(asctime)s, %(levelname)s, %(message)s')
-handler.setFormatter(formatter)
 
 PRACTICUM_TOKEN = os.getenv('PRACTICUM_TOKEN')
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
 
 RETRY_TIME = 600
+ERROR_RETRY_TIME = 30
+RETRY_JITTER = 5
 ENDPOINT = 'https://practicum.yandex.ru/api/user_api/homework_statuses/'
-HEADERS = {'Authorization': f'OAuth {PRACTICUM_TOKEN}'}
+API_TIMEOUT = (5, 30)
+
+
+@dataclass
+class LastSeen:
+    """Данные последнего успешного ответа API для условных запросов."""
+
+    from_date: int = 0
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+LAST_SEEN = LastSeen()
+PENDING_VALIDATORS = {}
+
+
+@dataclass
+class Shutdown:
+    """Флаг остановки бота, который можно ставить из обработчика сигнала.
+
+    Обработчик только меняет атрибут и не берёт блокировок, а ожидание
+    прерывается через signal.set_wakeup_fd().
+    """
+
+    requested: bool = False
+    reader: Optional[socket.socket] = None
+    writer: Optional[socket.socket] = None
+
+    def install(self, signum):
+        """Перехватывает сигнал signum для мягкой остановки бота."""
+        self.reader, self.writer = socket.socketpair()
+        self.reader.setblocking(False)
+        self.writer.setblocking(False)
+        signal.set_wakeup_fd(self.writer.fileno())
+        signal.signal(signum, self.handle)
+
+    def handle(self, signum, frame):
+        """Обработчик сигнала: помечает, что боту пора остановиться."""
+        self.requested = True
+
+    def wait(self, timeout):
+        """Ждёт timeout секунд или сигнала остановки.
+
+        Возвращает True, если поступил запрос на остановку.
+        """
+        if self.reader is None:
+            time.sleep(timeout)
+            return self.requested
+        deadline = time.monotonic() + timeout
+        while not self.requested:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            select.select([self.reader], [], [], remaining)
+            with suppress(BlockingIOError):
+                while self.reader.recv(64):
+                    pass
+        return self.requested
+
+    def close(self):
+        """Снимает wakeup fd и закрывает сокеты."""
+        if self.reader is None:
+            return
+        signal.set_wakeup_fd(-1)
+        self.reader.close()
+        self.writer.close()
+        self.reader = self.writer = None
+
 
+SHUTDOWN = Shutdown()
+
+STATE_PATH = os.path.expanduser(
+    os.getenv('HW_BOT_STATE', '~/.homework_bot.json')
+)
+MAX_SEEN = 1024
+SEEN = OrderedDict()
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+TELEGRAM_SEND_INTERVAL = 1
+MESSAGE_SEPARATOR = '\n\n'
 
 HOMEWORK_STATUSES = {
     'approved': 'Работа проверена: ревьюеру всё понравилось. Ура!',
@@ -39,25 +132,84 @@ HOMEWORK_STATUSES = {
 def send_message(bot, message):
     """Отправляет сообщение в Telegram чат."""
     try:
-        logger.info('Бот отправляет сообщение в телеграм.%s', message)
-        bot.send_message(TELEGRAM_CHAT_ID, message)
-    except telegram.error.TelegramError(message):
-        raise TelegramError(f'Ошибка отправки сообщения в телеграм: {message}')
+        logger.info('Бот отправляет сообщение в телеграм: %s', message)
+        try:
+            bot.send_message(TELEGRAM_CHAT_ID, message)
+        except RetryAfter as error:
+            logger.warning(
+                'Превышен лимит отправки в телеграм, повтор через %s с.',
+                error.retry_after,
+            )
+            if SHUTDOWN.wait(error.retry_after):
+                raise
+            bot.send_message(TELEGRAM_CHAT_ID, message)
+    except TelegramError as error:
+        raise TelegramError(
+            f'Ошибка отправки сообщения в телеграм: {error}'
+        ) from error
     else:
         logger.info('Сообщение в телеграм успешно отправлено.')
 
-def get_api_answer(current_timestamp):
+
+def split_messages(messages):
+    """Объединяет сообщения в блоки, не превышающие лимит Telegram."""
+    chunk = ''
+    for message in messages:
+        for start in range(0, len(message), TELEGRAM_MESSAGE_LIMIT):
+            part = message[start:start + TELEGRAM_MESSAGE_LIMIT]
+            if not chunk:
+                chunk = part
+            elif (len(chunk) + len(MESSAGE_SEPARATOR) + len(part)
+                  > TELEGRAM_MESSAGE_LIMIT):
+                yield chunk
+                chunk = part
+            else:
+                chunk = f'{chunk}{MESSAGE_SEPARATOR}{part}'
+    if chunk:
+        yield chunk
+
+
+def build_headers(token):
+    """Возвращает заголовки авторизации в API Практикум.Домашки."""
+    return {'Authorization': f'OAuth {token}'}
+
+
+def create_session(token):
+    """Создаёт HTTP-сессию с пулом соединений и повторами запросов."""
+    session = requests.Session()
+    session.headers.update(build_headers(token))
+    session.mount('https://', HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=4,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=(500, 502, 503, 504),
+        ),
+    ))
+    return session
+
+
+def get_api_answer(session, current_timestamp):
     """Делает запрос к эндпоинту Api-сервиса и возвращает ответ."""
     logger.info('Проверка на запрос к APi-сервису начата.')
     timestamp = current_timestamp or int(time.time())
-    params = {'from_date': timestamp}
-    data = {
-        'url': ENDPOINT.format(token=TELEGRAM_TOKEN),
-        'headers': HEADERS,
-        'params': params,
-    }
+    headers = {}
+    PENDING_VALIDATORS.clear()
+    if LAST_SEEN.etag:
+        headers['If-None-Match'] = LAST_SEEN.etag
+    if LAST_SEEN.last_modified:
+        headers['If-Modified-Since'] = LAST_SEEN.last_modified
     try:
-        response = requests.get(**data)
+        response = session.get(
+            ENDPOINT,
+            headers=headers,
+            params={'from_date': timestamp},
+            timeout=API_TIMEOUT,
+        )
+        if response.status_code == HTTPStatus.NOT_MODIFIED:
+            logger.info('Ответ API не изменился с прошлого запроса.')
+            return {'homeworks': [], 'current_date': timestamp}
         if response.status_code != HTTPStatus.OK:
             raise ApiErrorException(
                 'Неверный ответ сервера: '
@@ -65,7 +217,11 @@ def get_api_answer(current_timestamp):
                 f'reason = {response.reason}; '
                 f'content = {response.text}'
             )
-        return response.json()
+        PENDING_VALIDATORS.update(
+            etag=response.headers.get('ETag'),
+            last_modified=response.headers.get('Last-Modified'),
+        )
+        return json_loads(response.content)
     except Exception as error:
         message = f'Ошибка подключения к эндпоинту Api-сервиса:{error}'
         raise ApiErrorException(message)
@@ -74,90 +230,218 @@ def get_api_answer(current_timestamp):
 def check_response(response):
     """Проверяет ответ API на корректность."""
     logger.info('Проверка ответа от API начата.')
-
-    homework_list = {}
-
-    if isinstance(response, dict):
+    if type(response) is not dict:
+        raise TypeError(
+            f'Ответ от API не является словарём: response = {response}'
+        )
+    try:
         homework_list = response['homeworks']
-        if 'homeworks' not in response:
-            raise KeyError(
-                'В ответе API отсутствуют необходимый ключ "homeworks", '
-                f'response = {response}'
-            )
-        if 'current_date' not in response:
-            raise KeyError(
-                'В ответе API отсутствуют необходимый ключ "current_date", '
-                f'response = {response}'
-            )
-
-    if not isinstance(homework_list, list):
+        response['current_date']
+    except KeyError as error:
+        raise KeyError(
+            f'В ответе API отсутствуют необходимый ключ {error}, '
+            f'response = {response}'
+        ) from error
+    if type(homework_list) is not list:
         raise TypeError(
             f'Ответ от API не является списком: response = {response}'
         )
-
     return homework_list
 
 
 def parse_status(homework):
     """Извлекает из информации статус домашней работы."""
     logger.info('Проверка статуса домашней работы начата.')
-    if 'homework_name' in homework:
-        homework_name = homework.get('homework_name')
-    else:
-        raise KeyError('Отсутствует ключ "homework_name" в ответе от API')
-    if 'status' in homework:
-        homework_status = homework.get('status')
-    else:
-        raise KeyError('Отсутствует ключ "status" в ответе от API')
     try:
-        verdict = HOMEWORK_STATUSES[homework_status]
-    except KeyError:
+        homework_name = homework['homework_name']
+        homework_status = homework['status']
+    except KeyError as error:
+        raise KeyError(
+            f'Отсутствует ключ {error} в ответе от API'
+        ) from error
+    if homework_status not in HOMEWORK_STATUSES:
         message = ('API вернул неизвестный запрос'
                    f' {homework_status} for {homework_name}'
                    )
         raise ApiErrorException(message)
+    return format_status(homework_name, homework_status)
+
+
+@lru_cache(maxsize=512)
+def format_status(homework_name, homework_status):
+    """Формирует сообщение об изменении статуса домашней работы."""
+    verdict = HOMEWORK_STATUSES[homework_status]
     return f'Изменился статус проверки работы "{homework_name}". {verdict}'
 
 
+def status_key(homework):
+    """Возвращает ключ, однозначно описывающий статус домашней работы."""
+    return (
+        homework.get('id'),
+        homework.get('status'),
+        homework.get('date_updated'),
+    )
+
+
+def remember_status(key):
+    """Запоминает отправленный статус, вытесняя самые старые записи."""
+    SEEN[key] = None
+    SEEN.move_to_end(key)
+    if len(SEEN) > MAX_SEEN:
+        SEEN.popitem(last=False)
+
+
+def load_state():
+    """Загружает состояние бота, сохранённое до перезапуска."""
+    try:
+        with open(STATE_PATH, encoding='utf-8') as file:
+            state = json.load(file)
+        if not isinstance(state, dict):
+            raise ValueError(f'ожидался объект JSON, получено: {state!r}')
+        from_date = state.get('from_date', LAST_SEEN.from_date)
+        if type(from_date) is not int:
+            raise ValueError(f'некорректная дата: {from_date!r}')
+        etag = state.get('etag')
+        last_modified = state.get('last_modified')
+        for validator in (etag, last_modified):
+            if validator is not None and type(validator) is not str:
+                raise ValueError(f'некорректный валидатор: {validator!r}')
+        seen = OrderedDict()
+        for key in state.get('seen', []):
+            if not isinstance(key, list) or len(key) != 3:
+                raise ValueError(f'некорректный ключ статуса: {key!r}')
+            seen[tuple(key)] = None
+    except FileNotFoundError:
+        return
+    except (OSError, TypeError, ValueError) as error:
+        logger.error('Не удалось загрузить состояние бота: %s', error)
+        return
+    LAST_SEEN.from_date = from_date
+    LAST_SEEN.etag = etag
+    LAST_SEEN.last_modified = last_modified
+    SEEN.update(seen)
+
+
+def save_state():
+    """Атомарно сохраняет в файл состояние бота."""
+    state = {**asdict(LAST_SEEN), 'seen': list(SEEN)}
+    file = None
+    try:
+        with tempfile.NamedTemporaryFile(
+            'w',
+            dir=os.path.dirname(STATE_PATH) or '.',
+            delete=False,
+            encoding='utf-8',
+        ) as file:
+            json.dump(state, file, ensure_ascii=False)
+        os.replace(file.name, STATE_PATH)
+    except (OSError, TypeError, ValueError) as error:
+        logger.error('Не удалось сохранить состояние бота: %s', error)
+        if file is not None:
+            with suppress(OSError):
+                os.unlink(file.name)
+
+
+def notify_updates(bot, homework_list):
+    """Отправляет одним сообщением новые статусы домашних работ.
+
+    Возвращает False, если отправка прервана запросом на остановку.
+    """
+    keys, messages = [], []
+    for homework in homework_list:
+        key = status_key(homework)
+        if key in SEEN:
+            continue
+        keys.append(key)
+        try:
+            messages.append(parse_status(homework))
+        except (KeyError, ApiErrorException) as error:
+            logger.error('Не удалось разобрать статус работы: %s', error)
+    for index, chunk in enumerate(split_messages(dict.fromkeys(messages))):
+        if index and SHUTDOWN.wait(TELEGRAM_SEND_INTERVAL):
+            return False
+        send_message(bot, chunk)
+    for key in keys:
+        remember_status(key)
+    return True
+
+
+def poll_updates(session, bot):
+    """Запрашивает новые статусы работ и уведомляет о них.
+
+    Дата и валидаторы ответа (ETag, Last-Modified) сдвигаются и
+    сохраняются, только если все уведомления отправлены.
+    """
+    response = get_api_answer(session, LAST_SEEN.from_date)
+    homework_list = check_response(response)
+    if not notify_updates(bot, homework_list):
+        return
+    LAST_SEEN.from_date = response['current_date']
+    if PENDING_VALIDATORS:
+        LAST_SEEN.etag = PENDING_VALIDATORS['etag']
+        LAST_SEEN.last_modified = PENDING_VALIDATORS['last_modified']
+    save_state()
+
+
+def retry_delay(attempts):
+    """Возвращает паузу до следующего опроса с учётом подряд идущих сбоев."""
+    if not attempts:
+        return RETRY_TIME
+    delay = min(RETRY_TIME, ERROR_RETRY_TIME * 2 ** min(attempts, 10))
+    return min(RETRY_TIME, delay + random.uniform(0, RETRY_JITTER))
+
+
 def check_tokens():
     """Проверяет доступность переменных окружения."""
     logger.info('Проверка доступа переменных начата.')
-    return all((TELEGRAM_TOKEN, TELEGRAM_CHAT_ID, PRACTICUM_TOKEN))
+    tokens = (
+        ('PRACTICUM_TOKEN', PRACTICUM_TOKEN),
+        ('TELEGRAM_TOKEN', TELEGRAM_TOKEN),
+        ('TELEGRAM_CHAT_ID', TELEGRAM_CHAT_ID),
+    )
+    missing = [name for name, value in tokens if not value]
+    if missing:
+        logger.critical(
+            'Отсутствуют обязательные переменные окружения: %s',
+            ', '.join(missing),
+        )
+    return not missing
 
 
 def main():
     """Основная логика работы бота."""
+    logging.basicConfig(
+        level=logging.INFO,
+        stream=sys.stdout,
+        format='%(asctime)s, %(levelname)s, %(message)s',
+    )
     logger.info('Бот запущен')
     if not check_tokens():
-        message = (
-            'Отсутствуют обязательные переменные окружения: '
-            'TELEGRAM_TOKEN, TELEGRAM_CHAT_ID, PRACTICUM_TOKEN '
-            'Программа принудительно остановлена'
-        )
-        logger.critical(message)
-        sys.exit(message)
+        sys.exit('Программа принудительно остановлена')
     bot = telegram.Bot(token=TELEGRAM_TOKEN)
-    current_timestamp = int(time.time())
-    prev_upd_time = ''
+    session = create_session(PRACTICUM_TOKEN)
+    LAST_SEEN.from_date = int(time.time())
+    load_state()
+    attempts = 0
+    SHUTDOWN.install(signal.SIGTERM)
+    next_poll = time.monotonic()
 
-    while True:
-        try:
-            response = get_api_answer(current_timestamp)
-            homework_list = check_response(response)
-            for homework in homework_list:
-                upd_time = homework.get('date_updated')
-                if upd_time != prev_upd_time:
-                    prev_upd_time = upd_time
-                    message = parse_status(homework)
-                    send_message(bot, message)
-            current_timestamp = int(time.time())
-            time.sleep(RETRY_TIME)
-        except Exception as error:
-            message = f'Сбой в работе программы: {error}'
-            logger.error(message)
-            time.sleep(RETRY_TIME)
-        else:
-            time.sleep(RETRY_TIME)
+    try:
+        while not SHUTDOWN.requested:
+            try:
+                poll_updates(session, bot)
+                attempts = 0
+            except Exception as error:
+                attempts += 1
+                logger.error('Сбой в работе программы: %s', error)
+            next_poll = max(
+                next_poll + retry_delay(attempts), time.monotonic()
+            )
+            SHUTDOWN.wait(next_poll - time.monotonic())
+    finally:
+        session.close()
+        SHUTDOWN.close()
+        logger.info('Бот остановлен')
 
 
 if __name__ == '__main__':
@@ -1,4 +1,9 @@
+import json
 import os
+import signal
+import threading
+import time
+from collections import OrderedDict
 from http import HTTPStatus
 
 import requests
@@ -8,7 +13,7 @@ import utils
 
 class MockResponseGET:
 
-    def __init__(self, url, params=None, random_timestamp=None,
+    def __init__(self, url, params=None, session=None, random_timestamp=None,
                  current_timestamp=None, http_status=HTTPStatus.OK, **kwargs):
         assert (
             url.startswith(
@@ -18,15 +23,12 @@ class MockResponseGET:
             'Проверьте, что вы делаете запрос на правильный '
             'ресурс API для запроса статуса домашней работы'
         )
-        assert 'headers' in kwargs, (
-            'Проверьте, что вы передали заголовки `headers` для запроса '
-            'статуса домашней работы'
-        )
-        assert 'Authorization' in kwargs['headers'], (
+        headers = {**session.headers, **(kwargs.get('headers') or {})}
+        assert 'Authorization' in headers, (
             'Проверьте, что в параметры `headers` для запроса статуса '
             'домашней работы добавили Authorization'
         )
-        assert kwargs['headers']['Authorization'].startswith('OAuth '), (
+        assert headers['Authorization'].startswith('OAuth '), (
             'Проверьте, что в параметрах `headers` для запроса статуса '
             'домашней работы Authorization начинается с OAuth'
         )
@@ -44,6 +46,11 @@ class MockResponseGET:
         )
         self.random_timestamp = random_timestamp
         self.status_code = http_status
+        self.headers = {}
+
+    @property
+    def content(self):
+        return json.dumps(self.json()).encode()
 
     def json(self):
         data = {
@@ -73,6 +80,34 @@ class MockTelegramBot:
         return self.random_timestamp
 
 
+class MockRecordingBot:
+
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, chat_id=None, text=None, **kwargs):
+        self.sent.append(text)
+
+
+class MockApiResponse:
+
+    def __init__(self, payload=None, status_code=HTTPStatus.OK, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = json.dumps(payload).encode()
+
+
+class MockSession:
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.sent_headers = []
+
+    def get(self, url, headers=None, params=None, **kwargs):
+        self.sent_headers.append(headers or {})
+        return self.responses.pop(0)
+
+
 class TestHomework:
     HOMEWORK_STATUSES = {
         'approved': 'Работа проверена: ревьюеру всё понравилось. Ура!',
@@ -180,20 +215,22 @@ class TestHomework:
 
     def test_get_api_answers(self, monkeypatch, random_timestamp,
                              current_timestamp, api_url):
-        def mock_response_get(*args, **kwargs):
+        def mock_response_get(session, *args, **kwargs):
             return MockResponseGET(
-                *args, random_timestamp=random_timestamp,
+                *args, session=session, random_timestamp=random_timestamp,
                 current_timestamp=current_timestamp, **kwargs
             )
 
-        monkeypatch.setattr(requests, 'get', mock_response_get)
+        monkeypatch.setattr(requests.Session, 'get', mock_response_get)
 
         import homework
 
         func_name = 'get_api_answer'
-        utils.check_function(homework, func_name, 1)
+        utils.check_function(homework, func_name, 2)
+
+        session = homework.create_session('sometoken')
 
-        result = homework.get_api_answer(current_timestamp)
+        result = homework.get_api_answer(session, current_timestamp)
         assert type(result) == dict, (
             f'Проверьте, что из функции `{func_name}` '
             'возвращается словарь'
@@ -217,9 +254,9 @@ class TestHomework:
 
     def test_get_500_api_answer(self, monkeypatch, random_timestamp,
                                 current_timestamp, api_url):
-        def mock_500_response_get(*args, **kwargs):
+        def mock_500_response_get(session, *args, **kwargs):
             response = MockResponseGET(
-                *args, random_timestamp=random_timestamp,
+                *args, session=session, random_timestamp=random_timestamp,
                 current_timestamp=current_timestamp,
                 http_status=HTTPStatus.INTERNAL_SERVER_ERROR, **kwargs
             )
@@ -232,13 +269,14 @@ class TestHomework:
             response.json = json_invalid
             return response
 
-        monkeypatch.setattr(requests, 'get', mock_500_response_get)
+        monkeypatch.setattr(requests.Session, 'get', mock_500_response_get)
 
         import homework
 
         func_name = 'get_api_answer'
         try:
-            homework.get_api_answer(current_timestamp)
+            session = homework.create_session('sometoken')
+            homework.get_api_answer(session, current_timestamp)
         except:
             pass
         else:
@@ -293,9 +331,9 @@ class TestHomework:
 
     def test_check_response(self, monkeypatch, random_timestamp,
                             current_timestamp, api_url):
-        def mock_response_get(*args, **kwargs):
+        def mock_response_get(session, *args, **kwargs):
             response = MockResponseGET(
-                *args, random_timestamp=random_timestamp,
+                *args, session=session, random_timestamp=random_timestamp,
                 current_timestamp=current_timestamp,
                 **kwargs
             )
@@ -315,12 +353,13 @@ class TestHomework:
             response.json = valid_response_json
             return response
 
-        monkeypatch.setattr(requests, 'get', mock_response_get)
+        monkeypatch.setattr(requests.Session, 'get', mock_response_get)
 
         import homework
 
         func_name = 'check_response'
-        response = homework.get_api_answer(current_timestamp)
+        session = homework.create_session('sometoken')
+        response = homework.get_api_answer(session, current_timestamp)
         status = homework.check_response(response)
         assert status, (
             f'Убедитесь, что функция `{func_name} '
@@ -330,9 +369,9 @@ class TestHomework:
 
     def test_parse_status_unknown_status(self, monkeypatch, random_timestamp,
                                          current_timestamp, api_url):
-        def mock_response_get(*args, **kwargs):
+        def mock_response_get(session, *args, **kwargs):
             response = MockResponseGET(
-                *args, random_timestamp=random_timestamp,
+                *args, session=session, random_timestamp=random_timestamp,
                 current_timestamp=current_timestamp,
                 **kwargs
             )
@@ -352,12 +391,13 @@ class TestHomework:
             response.json = valid_response_json
             return response
 
-        monkeypatch.setattr(requests, 'get', mock_response_get)
+        monkeypatch.setattr(requests.Session, 'get', mock_response_get)
 
         import homework
 
         func_name = 'parse_status'
-        response = homework.get_api_answer(current_timestamp)
+        session = homework.create_session('sometoken')
+        response = homework.get_api_answer(session, current_timestamp)
         homeworks = homework.check_response(response)
         for hw in homeworks:
             status_message = None
@@ -379,9 +419,9 @@ class TestHomework:
 
     def test_parse_status_no_status_key(self, monkeypatch, random_timestamp,
                                         current_timestamp, api_url):
-        def mock_response_get(*args, **kwargs):
+        def mock_response_get(session, *args, **kwargs):
             response = MockResponseGET(
-                *args, random_timestamp=random_timestamp,
+                *args, session=session, random_timestamp=random_timestamp,
                 current_timestamp=current_timestamp,
                 **kwargs
             )
@@ -400,12 +440,13 @@ class TestHomework:
             response.json = valid_response_json
             return response
 
-        monkeypatch.setattr(requests, 'get', mock_response_get)
+        monkeypatch.setattr(requests.Session, 'get', mock_response_get)
 
         import homework
 
         func_name = 'parse_status'
-        response = homework.get_api_answer(current_timestamp)
+        session = homework.create_session('sometoken')
+        response = homework.get_api_answer(session, current_timestamp)
         homeworks = homework.check_response(response)
         for hw in homeworks:
             status_message = None
@@ -427,9 +468,9 @@ class TestHomework:
 
     def test_parse_status_no_homework_name_key(self, monkeypatch, random_timestamp,
                                                current_timestamp, api_url):
-        def mock_response_get(*args, **kwargs):
+        def mock_response_get(session, *args, **kwargs):
             response = MockResponseGET(
-                *args, random_timestamp=random_timestamp,
+                *args, session=session, random_timestamp=random_timestamp,
                 current_timestamp=current_timestamp,
                 **kwargs
             )
@@ -448,12 +489,13 @@ class TestHomework:
             response.json = valid_response_json
             return response
 
-        monkeypatch.setattr(requests, 'get', mock_response_get)
+        monkeypatch.setattr(requests.Session, 'get', mock_response_get)
 
         import homework
 
         func_name = 'parse_status'
-        response = homework.get_api_answer(current_timestamp)
+        session = homework.create_session('sometoken')
+        response = homework.get_api_answer(session, current_timestamp)
         homeworks = homework.check_response(response)
         try:
             for hw in homeworks:
@@ -468,9 +510,9 @@ class TestHomework:
 
     def test_check_response_no_homeworks(self, monkeypatch, random_timestamp,
                                          current_timestamp, api_url):
-        def mock_no_homeworks_response_get(*args, **kwargs):
+        def mock_no_homeworks_response_get(session, *args, **kwargs):
             response = MockResponseGET(
-                *args, random_timestamp=random_timestamp,
+                *args, session=session, random_timestamp=random_timestamp,
                 current_timestamp=current_timestamp,
                 **kwargs
             )
@@ -484,12 +526,13 @@ class TestHomework:
             response.json = json_invalid
             return response
 
-        monkeypatch.setattr(requests, 'get', mock_no_homeworks_response_get)
+        monkeypatch.setattr(requests.Session, 'get', mock_no_homeworks_response_get)
 
         import homework
 
         func_name = 'check_response'
-        result = homework.get_api_answer(current_timestamp)
+        session = homework.create_session('sometoken')
+        result = homework.get_api_answer(session, current_timestamp)
         try:
             homework.check_response(result)
         except:
@@ -503,9 +546,9 @@ class TestHomework:
 
     def test_check_response_not_dict(self, monkeypatch, random_timestamp,
                                      current_timestamp, api_url):
-        def mock_response_get(*args, **kwargs):
+        def mock_response_get(session, *args, **kwargs):
             response = MockResponseGET(
-                *args, random_timestamp=random_timestamp,
+                *args, session=session, random_timestamp=random_timestamp,
                 current_timestamp=current_timestamp,
                 **kwargs
             )
@@ -525,12 +568,13 @@ class TestHomework:
             response.json = valid_response_json
             return response
 
-        monkeypatch.setattr(requests, 'get', mock_response_get)
+        monkeypatch.setattr(requests.Session, 'get', mock_response_get)
 
         import homework
 
         func_name = 'check_response'
-        response = homework.get_api_answer(current_timestamp)
+        session = homework.create_session('sometoken')
+        response = homework.get_api_answer(session, current_timestamp)
         try:
             status = homework.check_response(response)
         except TypeError:
@@ -544,9 +588,9 @@ class TestHomework:
 
     def test_check_response_homeworks_not_in_list(self, monkeypatch, random_timestamp,
                                                   current_timestamp, api_url):
-        def mock_response_get(*args, **kwargs):
+        def mock_response_get(session, *args, **kwargs):
             response = MockResponseGET(
-                *args, random_timestamp=random_timestamp,
+                *args, session=session, random_timestamp=random_timestamp,
                 current_timestamp=current_timestamp,
                 **kwargs
             )
@@ -565,12 +609,13 @@ class TestHomework:
             response.json = valid_response_json
             return response
 
-        monkeypatch.setattr(requests, 'get', mock_response_get)
+        monkeypatch.setattr(requests.Session, 'get', mock_response_get)
 
         import homework
 
         func_name = 'check_response'
-        response = homework.get_api_answer(current_timestamp)
+        session = homework.create_session('sometoken')
+        response = homework.get_api_answer(session, current_timestamp)
         try:
             homeworks = homework.check_response(response)
         except:
@@ -584,9 +629,9 @@ class TestHomework:
 
     def test_check_response_empty(self, monkeypatch, random_timestamp,
                                   current_timestamp, api_url):
-        def mock_empty_response_get(*args, **kwargs):
+        def mock_empty_response_get(session, *args, **kwargs):
             response = MockResponseGET(
-                *args, random_timestamp=random_timestamp,
+                *args, session=session, random_timestamp=random_timestamp,
                 current_timestamp=current_timestamp,
                 **kwargs
             )
@@ -599,12 +644,13 @@ class TestHomework:
             response.json = json_invalid
             return response
 
-        monkeypatch.setattr(requests, 'get', mock_empty_response_get)
+        monkeypatch.setattr(requests.Session, 'get', mock_empty_response_get)
 
         import homework
 
         func_name = 'check_response'
-        result = homework.get_api_answer(current_timestamp)
+        session = homework.create_session('sometoken')
+        result = homework.get_api_answer(session, current_timestamp)
         try:
             homework.check_response(result)
         except:
@@ -618,21 +664,22 @@ class TestHomework:
 
     def test_api_response_timeout(self, monkeypatch, random_timestamp,
                                   current_timestamp, api_url):
-        def mock_response_get(*args, **kwargs):
+        def mock_response_get(session, *args, **kwargs):
             response = MockResponseGET(
-                *args, random_timestamp=random_timestamp,
+                *args, session=session, random_timestamp=random_timestamp,
                 current_timestamp=current_timestamp,
                 http_status=HTTPStatus.REQUEST_TIMEOUT, **kwargs
             )
             return response
 
-        monkeypatch.setattr(requests, 'get', mock_response_get)
+        monkeypatch.setattr(requests.Session, 'get', mock_response_get)
 
         import homework
 
         func_name = 'check_response'
         try:
-            homework.get_api_answer(current_timestamp)
+            session = homework.create_session('sometoken')
+            homework.get_api_answer(session, current_timestamp)
         except:
             pass
         else:
@@ -640,3 +687,250 @@ class TestHomework:
                 f'Убедитесь, что в функции `{func_name}` обрабатываете ситуацию, '
                 'когда API возвращает код, отличный от 200'
             )
+
+    def test_split_messages(self):
+        import homework
+
+        limit = homework.TELEGRAM_MESSAGE_LIMIT
+        separator = homework.MESSAGE_SEPARATOR
+        half = 'a' * ((limit - len(separator)) // 2)
+        chunks = list(homework.split_messages([half, half, 'b']))
+        assert chunks == [f'{half}{separator}{half}', 'b'], (
+            'Проверьте, что сообщения объединяются в блоки '
+            'не длиннее лимита Telegram'
+        )
+        chunks = list(homework.split_messages(['c' * (limit + 10)]))
+        assert [len(chunk) for chunk in chunks] == [limit, 10], (
+            'Проверьте, что слишком длинное сообщение разбивается на части'
+        )
+
+    def test_notify_updates(self, monkeypatch):
+        import homework
+
+        monkeypatch.setattr(homework, 'SEEN', OrderedDict())
+        homeworks = [
+            {'id': 1, 'homework_name': 'hw1', 'status': 'approved'},
+            {'id': 2, 'homework_name': 'hw2', 'status': 'rejected'},
+        ]
+        bot = MockRecordingBot()
+        homework.notify_updates(bot, homeworks)
+        assert len(bot.sent) == 1, (
+            'Проверьте, что новые статусы отправляются одним сообщением'
+        )
+        assert 'hw1' in bot.sent[0] and 'hw2' in bot.sent[0]
+        homework.notify_updates(bot, homeworks)
+        assert len(bot.sent) == 1, (
+            'Проверьте, что уже отправленные статусы не отправляются повторно'
+        )
+
+    def test_notify_updates_unknown_status(self, monkeypatch):
+        import homework
+
+        monkeypatch.setattr(homework, 'SEEN', OrderedDict())
+        homeworks = [
+            {'id': 1, 'homework_name': 'hw1', 'status': 'approved'},
+            {'id': 2, 'homework_name': 'hw2', 'status': 'unknown'},
+        ]
+        bot = MockRecordingBot()
+        homework.notify_updates(bot, homeworks)
+        assert len(bot.sent) == 1 and 'hw1' in bot.sent[0], (
+            'Проверьте, что работа с неизвестным статусом не мешает '
+            'отправке остальных статусов'
+        )
+        assert homework.status_key(homeworks[1]) in homework.SEEN
+
+    def test_retry_delay(self):
+        import homework
+
+        delays = [homework.retry_delay(attempts) for attempts in range(20)]
+        delays.append(homework.retry_delay(10 ** 6))
+        assert delays[0] == homework.RETRY_TIME
+        assert delays[1] < homework.RETRY_TIME, (
+            'Проверьте, что после сбоя бот повторяет запрос раньше'
+        )
+        assert max(delays) <= homework.RETRY_TIME, (
+            'Проверьте, что пауза после сбоев не превышает RETRY_TIME'
+        )
+
+    def test_save_and_load_state(self, monkeypatch, tmp_path):
+        import homework
+
+        monkeypatch.setattr(homework, 'STATE_PATH', str(tmp_path / 'state.json'))
+        monkeypatch.setattr(homework, 'SEEN', OrderedDict())
+        monkeypatch.setattr(
+            homework, 'LAST_SEEN',
+            homework.LastSeen(from_date=42, etag='"v1"', last_modified=None)
+        )
+        homework.remember_status((1, 'approved', '2020-02-13T14:40:57Z'))
+        homework.save_state()
+        assert [path.name for path in tmp_path.iterdir()] == ['state.json'], (
+            'Проверьте, что после сохранения не остаются временные файлы'
+        )
+
+        monkeypatch.setattr(homework, 'SEEN', OrderedDict())
+        monkeypatch.setattr(homework, 'LAST_SEEN', homework.LastSeen())
+        homework.load_state()
+        assert homework.LAST_SEEN == homework.LastSeen(
+            from_date=42, etag='"v1"', last_modified=None
+        )
+        assert list(homework.SEEN) == [
+            (1, 'approved', '2020-02-13T14:40:57Z')
+        ]
+
+    def test_load_corrupt_state(self, monkeypatch, tmp_path):
+        import homework
+
+        state_path = tmp_path / 'state.json'
+        monkeypatch.setattr(homework, 'STATE_PATH', str(state_path))
+        monkeypatch.setattr(homework, 'SEEN', OrderedDict())
+        monkeypatch.setattr(homework, 'LAST_SEEN', homework.LastSeen())
+        for content in ('{', 'null', '{"seen": [1]}', '{"seen": [[[], 1, 2]]}',
+                        '{"from_date": "yesterday"}', '{"etag": 5}',
+                        '{"last_modified": ["Mon"]}'):
+            state_path.write_text(content, encoding='utf-8')
+            homework.load_state()
+            assert homework.LAST_SEEN == homework.LastSeen(), (
+                'Проверьте, что повреждённый файл состояния игнорируется'
+            )
+            assert not homework.SEEN
+
+    def test_save_state_failure_cleans_up(self, monkeypatch, tmp_path):
+        import homework
+
+        def broken_replace(src, dst):
+            raise OSError('disk is full')
+
+        monkeypatch.setattr(homework, 'STATE_PATH', str(tmp_path / 'state.json'))
+        monkeypatch.setattr(homework.os, 'replace', broken_replace)
+        homework.save_state()
+        assert not list(tmp_path.iterdir()), (
+            'Проверьте, что при ошибке сохранения временный файл удаляется'
+        )
+
+    def test_get_api_answer_not_modified(self, monkeypatch, tmp_path):
+        import homework
+
+        monkeypatch.setattr(homework, 'STATE_PATH', str(tmp_path / 'state.json'))
+        monkeypatch.setattr(homework, 'SEEN', OrderedDict())
+        monkeypatch.setattr(homework, 'LAST_SEEN', homework.LastSeen(from_date=1))
+        monkeypatch.setattr(homework, 'PENDING_VALIDATORS', {})
+        session = MockSession(
+            MockApiResponse(
+                {'homeworks': [], 'current_date': 2}, headers={'ETag': '"v1"'}
+            ),
+            MockApiResponse(status_code=HTTPStatus.NOT_MODIFIED),
+        )
+        homework.poll_updates(session, MockRecordingBot())
+        result = homework.get_api_answer(session, homework.LAST_SEEN.from_date)
+        assert session.sent_headers[1].get('If-None-Match') == '"v1"', (
+            'Проверьте, что повторный запрос передаёт ETag '
+            'в заголовке If-None-Match'
+        )
+        assert result == {'homeworks': [], 'current_date': 2}, (
+            'Проверьте, что при ответе 304 функция `get_api_answer` '
+            'возвращает пустой список домашних работ'
+        )
+
+    def test_etag_kept_until_updates_sent(self, monkeypatch, tmp_path):
+        import homework
+
+        class MockFailingBot:
+
+            def send_message(self, chat_id=None, text=None, **kwargs):
+                raise telegram.error.NetworkError('network is down')
+
+        monkeypatch.setattr(homework, 'STATE_PATH', str(tmp_path / 'state.json'))
+        monkeypatch.setattr(homework, 'SEEN', OrderedDict())
+        monkeypatch.setattr(homework, 'LAST_SEEN', homework.LastSeen(from_date=1))
+        monkeypatch.setattr(homework, 'PENDING_VALIDATORS', {})
+        payload = {
+            'homeworks': [
+                {'id': 1, 'homework_name': 'hw1', 'status': 'approved'},
+            ],
+            'current_date': 2,
+        }
+        session = MockSession(
+            MockApiResponse(payload, headers={'ETag': '"v1"'}),
+            MockApiResponse(payload, headers={'ETag': '"v1"'}),
+        )
+        try:
+            homework.poll_updates(session, MockFailingBot())
+        except telegram.error.TelegramError:
+            pass
+        else:
+            assert False, 'Ошибка отправки должна прерывать опрос'
+        bot = MockRecordingBot()
+        homework.poll_updates(session, bot)
+        assert 'If-None-Match' not in session.sent_headers[1], (
+            'Убедитесь, что ETag необработанного ответа не используется '
+            'для условного запроса'
+        )
+        assert len(bot.sent) == 1 and homework.LAST_SEEN.etag == '"v1"'
+
+    def test_shutdown_interrupts_wait(self):
+        import homework
+
+        shutdown = homework.Shutdown()
+        previous_handler = signal.getsignal(signal.SIGUSR1)
+        shutdown.install(signal.SIGUSR1)
+        timer = threading.Timer(
+            0.1, os.kill, args=(os.getpid(), signal.SIGUSR1)
+        )
+        try:
+            timer.start()
+            started = time.monotonic()
+            stopped = shutdown.wait(5)
+        finally:
+            timer.cancel()
+            shutdown.close()
+            signal.signal(signal.SIGUSR1, previous_handler)
+        assert stopped and time.monotonic() - started < 2, (
+            'Убедитесь, что сигнал остановки прерывает ожидание'
+        )
+
+    def test_send_message_retry_after(self, monkeypatch):
+        import homework
+
+        class MockRateLimitedBot(MockRecordingBot):
+
+            def send_message(self, chat_id=None, text=None, **kwargs):
+                if not self.sent:
+                    self.sent.append(None)
+                    raise telegram.error.RetryAfter(3)
+                super().send_message(chat_id, text, **kwargs)
+
+        waits = []
+        monkeypatch.setattr(homework.time, 'sleep', waits.append)
+        bot = MockRateLimitedBot()
+        homework.send_message(bot, 'hello')
+        assert waits == [3], (
+            'Убедитесь, что при RetryAfter бот ждёт указанное время'
+        )
+        assert bot.sent == [None, 'hello'], (
+            'Убедитесь, что после RetryAfter сообщение отправляется повторно'
+        )
+
+    def test_poll_updates_aborted_by_shutdown(self, monkeypatch, tmp_path):
+        import homework
+
+        monkeypatch.setattr(homework, 'STATE_PATH', str(tmp_path / 'state.json'))
+        monkeypatch.setattr(homework, 'SEEN', OrderedDict())
+        monkeypatch.setattr(homework, 'LAST_SEEN', homework.LastSeen(from_date=1))
+        monkeypatch.setattr(homework, 'SHUTDOWN', homework.Shutdown(requested=True))
+        monkeypatch.setattr(homework, 'TELEGRAM_MESSAGE_LIMIT', 100)
+        monkeypatch.setattr(homework.time, 'sleep', lambda seconds: None)
+        session = MockSession(MockApiResponse({
+            'homeworks': [
+                {'id': 1, 'homework_name': 'hw1', 'status': 'approved'},
+                {'id': 2, 'homework_name': 'hw2', 'status': 'rejected'},
+            ],
+            'current_date': 999,
+        }))
+        bot = MockRecordingBot()
+        homework.poll_updates(session, bot)
+        assert len(bot.sent) == 1
+        assert not homework.SEEN and homework.LAST_SEEN.from_date == 1, (
+            'Убедитесь, что при прерванной отправке состояние бота '
+            'не сдвигается и недоставленные статусы запрашиваются снова'
+        )
+        assert not (tmp_path / 'state.json').exists()